@@ -0,0 +1,69 @@
+"""Encoders that run Transformer models using ONNX Runtime.
+
+This module requires the `onnx` extra.
+"""
+
+from copy import copy
+from typing import TYPE_CHECKING, cast
+
+import onnxruntime as ort
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+
+from fast_forward.encoder.base import Encoder
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+    from pathlib import Path
+
+    import numpy as np
+
+    from fast_forward.encoder.transformer import TransformerEncoder
+
+
+class ONNXEncoder(Encoder):
+    """Runs the model of a Transformer encoder using ONNX Runtime.
+
+    Tokenization and aggregation of the outputs are taken from the original encoder.
+    The ONNX model can be created using `TransformerEncoder.export_onnx`.
+    """
+
+    def __init__(
+        self,
+        encoder: "TransformerEncoder",
+        onnx_file: "Path",
+        providers: "Sequence[str]" = ("CPUExecutionProvider",),
+    ) -> None:
+        """Create an ONNX encoder.
+
+        :param encoder: The original encoder.
+        :param onnx_file: The exported ONNX model of the encoder.
+        :param providers: ONNX Runtime execution providers.
+        """
+        super().__init__()
+        self._session = ort.InferenceSession(onnx_file, providers=list(providers))
+        self._input_names = [i.name for i in self._session.get_inputs()]
+        # only the model of the (shallow) copy is replaced, the original encoder and its
+        # model remain usable
+        self._encoder = copy(encoder)
+        self._encoder._forward = self._run_session
+
+    def _run_session(self, **model_inputs: torch.Tensor) -> BaseModelOutput:
+        """Run the ONNX model.
+
+        :param model_inputs: The Transformer inputs.
+        :return: The Transformer outputs (on the same device as the inputs).
+        """
+        (last_hidden_state,) = self._session.run(
+            ["last_hidden_state"],
+            {name: model_inputs[name].cpu().numpy() for name in self._input_names},
+        )
+        device = model_inputs[self._input_names[0]].device
+        return BaseModelOutput(
+            last_hidden_state=cast(
+                torch.FloatTensor, torch.from_numpy(last_hidden_state).to(device)
+            )
+        )
+
+    def _encode(self, texts: "Sequence[str]") -> "np.ndarray":
+        return self._encoder(texts)
@@ -1,3 +1,6 @@
+from contextlib import nullcontext
+from copy import copy
+from functools import lru_cache
 from typing import TYPE_CHECKING, Any
 
 import torch
@@ -14,6 +17,26 @@ if TYPE_CHECKING:
     from transformers.modeling_outputs import BaseModelOutput
 
 
+class _LastHiddenState(torch.nn.Module):
+    """Wraps a Transformer model such that only the last hidden state is returned."""
+
+    def __init__(self, model: torch.nn.Module) -> None:
+        """Create a wrapper.
+
+        :param model: The Transformer model.
+        """
+        super().__init__()
+        self._model = model
+
+    def forward(self, **model_inputs: torch.Tensor) -> torch.Tensor:
+        """Return the last hidden state of the Transformer model.
+
+        :param model_inputs: The Transformer inputs.
+        :return: The last hidden state.
+        """
+        return self._model(**model_inputs).last_hidden_state
+
+
 class TransformerEncoder(Encoder):
     """Uses a pre-trained Transformer model for encoding.
 
@@ -31,24 +54,67 @@ class TransformerEncoder(Encoder):
             "truncation": True,
         },
         normalize: bool = False,
+        tokenizer_cache_size: int = 0,
+        compile_model: bool = False,
+        dtype: torch.dtype | None = None,
     ) -> None:
         """Create a Transformer encoder.
 
+        Tokenizer outputs can be cached for batches that are encoded repeatedly (e.g.,
+        the same queries in multiple experiments).
+
         :param model: Pre-trained Transformer model (name or path).
         :param device: PyTorch device.
         :param model_args: Additional arguments for the model.
         :param tokenizer_args: Additional arguments for the tokenizer.
         :param tokenizer_call_args: Additional arguments for the tokenizer call.
         :param normalize: L2-normalize output representations.
+        :param tokenizer_cache_size: Number of batches to cache tokenizer outputs for.
+        :param compile_model: Compile the model using `torch.compile`.
+        :param dtype:
+            Reduced precision to run the model in using automatic mixed precision (e.g.,
+            `torch.float16` on GPUs or `torch.bfloat16` on CPUs). The outputs are always
+            `float32`.
         """
         super().__init__()
         self._model = AutoModel.from_pretrained(model, **model_args)
         self._model.to(device)
         self._model.eval()
+        # the model is run through this hook, which other runtimes may replace (e.g.,
+        # `fast_forward.encoder.onnx.ONNXEncoder`); the eager model is kept for
+        # exporting, the compiled one is only used to encode (batch size and sequence
+        # length vary between batches)
+        self._forward = (
+            torch.compile(self._model, dynamic=True) if compile_model else self._model
+        )
         self._tokenizer = AutoTokenizer.from_pretrained(model, **tokenizer_args)
         self._device = device
+        self._dtype = dtype
         self._tokenizer_call_args = tokenizer_call_args
         self._normalize = normalize
+        self._tokenizer_cache_size = tokenizer_cache_size
+        self._tokenize_cached = lru_cache(maxsize=tokenizer_cache_size)(self._tokenize)
+
+    def __getstate__(self) -> dict[str, Any]:
+        """Return the state of the encoder for pickling.
+
+        The tokenizer cache can not be pickled, hence it is dropped.
+
+        :return: The state of the encoder.
+        """
+        state = self.__dict__.copy()
+        del state["_tokenize_cached"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        """Restore the state of the encoder after unpickling with an empty cache.
+
+        :param state: The state of the encoder.
+        """
+        vars(self).update(state)
+        self._tokenize_cached = lru_cache(maxsize=self._tokenizer_cache_size)(
+            self._tokenize
+        )
 
     def _get_tokenizer_inputs(self, texts: "Sequence[str]") -> list[str]:
         """Prepare input texts for tokenization.
@@ -58,6 +124,18 @@ class TransformerEncoder(Encoder):
         """
         return list(texts)
 
+    def _tokenize(self, texts: tuple[str, ...]) -> "BatchEncoding":
+        """Tokenize a batch of texts.
+
+        :param texts: The texts to encode.
+        :return: The tokenizer outputs (on the CPU).
+        """
+        return self._tokenizer(
+            self._get_tokenizer_inputs(texts),
+            return_tensors="pt",
+            **self._tokenizer_call_args,
+        )
+
     def _aggregate_model_outputs(
         self,
         model_outputs: "BaseModelOutput",
@@ -73,19 +151,51 @@ class TransformerEncoder(Encoder):
         """
         return model_outputs.last_hidden_state[:, 0]
 
-    def _encode(self, texts: "Sequence[str]") -> "np.ndarray":
-        model_inputs = self._tokenizer(
-            self._get_tokenizer_inputs(texts),
-            return_tensors="pt",
-            **self._tokenizer_call_args,
-        ).to(self._device)
+    def export_onnx(self, target: "Path", opset_version: int = 18) -> None:
+        """Export the Transformer model to ONNX.
+
+        Batch size and sequence length remain dynamic. The exported model can be used
+        with `fast_forward.encoder.onnx.ONNXEncoder`. This requires the `onnx` extra.
 
-        with torch.no_grad():
-            model_outputs = self._model(**model_inputs)
+        :param target: The ONNX file to create.
+        :param opset_version: The ONNX opset version.
+        """
+        # dimensions of size one would be specialized, hence the dummy batch of two
+        model_inputs = self._tokenize(("dummy input",) * 2).to(self._device)
+        batch_dim = torch.export.Dim("batch")
+        seq_dim = torch.export.Dim("sequence")
+        torch.onnx.export(
+            _LastHiddenState(self._model),
+            (),
+            target,
+            kwargs=dict(model_inputs),
+            input_names=list(model_inputs.keys()),
+            output_names=["last_hidden_state"],
+            opset_version=opset_version,
+            dynamo=True,
+            dynamic_shapes={
+                "model_inputs": {k: {0: batch_dim, 1: seq_dim} for k in model_inputs}
+            },
+        )
+
+    def _encode(self, texts: "Sequence[str]") -> "np.ndarray":
+        # cached tokenizer outputs remain on the CPU, hence the copy
+        model_inputs = copy(self._tokenize_cached(tuple(texts))).to(self._device)
+
+        # autocast does not support all devices, hence it is only used if necessary
+        autocast = (
+            nullcontext()
+            if self._dtype is None
+            else torch.autocast(torch.device(self._device).type, dtype=self._dtype)
+        )
+        with torch.inference_mode(), autocast:
+            model_outputs = self._forward(**model_inputs)
             result = self._aggregate_model_outputs(model_outputs, model_inputs)
             if self._normalize:
                 result = torch.nn.functional.normalize(result, p=2, dim=1)
-        return result.cpu().detach().numpy()
+        # the result may be a view of the model outputs, a contiguous copy releases them
+        # and the conversion to numpy does not copy anymore
+        return result.float().cpu().contiguous().numpy()
 
 
 class TCTColBERTQueryEncoder(TransformerEncoder):
@@ -102,14 +212,23 @@ class TCTColBERTQueryEncoder(TransformerEncoder):
         model: "str | Path" = "castorini/tct_colbert-msmarco",
         device: str = "cpu",
         max_length: int = 36,
+        tokenizer_cache_size: int = 0,
+        compile_model: bool = False,
+        dtype: torch.dtype | None = None,
     ) -> None:
         """Create a TCT-ColBERT query encoder.
 
         :param model: Pre-trained TCT-ColBERT model (name or path).
         :param device: PyTorch device.
         :param max_length: Maximum number of tokens per query.
+        :param tokenizer_cache_size: Number of batches to cache tokenizer outputs for.
+        :param compile_model: Compile the model using `torch.compile`.
+        :param dtype: Reduced precision to run the model in (mixed precision).
         """
         self._max_length = max_length
+        # the query prefix and suffix are the same for all queries
+        self._query_prefix = "[CLS] [Q] "
+        self._mask_suffix = "[MASK]" * max_length
         super().__init__(
             model,
             device=device,
@@ -118,10 +237,13 @@ class TCTColBERTQueryEncoder(TransformerEncoder):
                 "truncation": True,
                 "add_special_tokens": False,
             },
+            tokenizer_cache_size=tokenizer_cache_size,
+            compile_model=compile_model,
+            dtype=dtype,
         )
 
     def _get_tokenizer_inputs(self, texts: "Sequence[str]") -> list[str]:
-        return ["[CLS] [Q] " + q + "[MASK]" * self._max_length for q in texts]
+        return [f"{self._query_prefix}{q}{self._mask_suffix}" for q in texts]
 
     def _aggregate_model_outputs(
         self,
@@ -146,12 +268,16 @@ class TCTColBERTDocumentEncoder(TransformerEncoder):
         model: "str | Path" = "castorini/tct_colbert-msmarco",
         device: str = "cpu",
         max_length: int = 512,
+        compile_model: bool = False,
+        dtype: torch.dtype | None = None,
     ) -> None:
         """Create a TCT-ColBERT document encoder.
 
         :param model: Pre-trained TCT-ColBERT model (name or path).
         :param device: PyTorch device.
         :param max_length: Maximum number of tokens per document.
+        :param compile_model: Compile the model using `torch.compile`.
+        :param dtype: Reduced precision to run the model in (mixed precision).
         """
         self._max_length = max_length
         super().__init__(
@@ -163,6 +289,8 @@ class TCTColBERTDocumentEncoder(TransformerEncoder):
                 "truncation": True,
                 "add_special_tokens": False,
             },
+            compile_model=compile_model,
+            dtype=dtype,
         )
 
     def _get_tokenizer_inputs(self, texts: "Sequence[str]") -> list[str]:
@@ -195,14 +323,18 @@ class TASBEncoder(TransformerEncoder):
         self,
         model: "str | Path" = "sebastian-hofstaetter/distilbert-dot-tas_b-b256-msmarco",
         device: str = "cpu",
+        compile_model: bool = False,
+        dtype: torch.dtype | None = None,
     ) -> None:
         """Create a TAS-B encoder.
 
         :param model: Pre-trained TAS-B model (name or path).
         :param device: PyTorch device.
+        :param compile_model: Compile the model using `torch.compile`.
+        :param dtype: Reduced precision to run the model in (mixed precision).
         """
         # TAS-B uses CLS-pooling (TransformerEncoder default)
-        super().__init__(model, device=device)
+        super().__init__(model, device=device, compile_model=compile_model, dtype=dtype)
 
 
 class ContrieverEncoder(TransformerEncoder):
@@ -217,13 +349,17 @@ class ContrieverEncoder(TransformerEncoder):
         self,
         model: "str | Path" = "facebook/contriever",
         device: str = "cpu",
+        compile_model: bool = False,
+        dtype: torch.dtype | None = None,
     ) -> None:
         """Create a Contriever encoder.
 
         :param model: Pre-trained Contriever model (name or path).
         :param device: PyTorch device.
+        :param compile_model: Compile the model using `torch.compile`.
+        :param dtype: Reduced precision to run the model in (mixed precision).
         """
-        super().__init__(model, device=device)
+        super().__init__(model, device=device, compile_model=compile_model, dtype=dtype)
 
     def _aggregate_model_outputs(
         self,
@@ -249,10 +385,20 @@ class BGEEncoder(TransformerEncoder):
         self,
         model: "str | Path" = "BAAI/bge-base-en-v1.5",
         device: str = "cpu",
+        compile_model: bool = False,
+        dtype: torch.dtype | None = None,
     ) -> None:
         """Create a BGE encoder.
 
         :param model: Pre-trained BGE model (name or path).
         :param device: PyTorch device.
+        :param compile_model: Compile the model using `torch.compile`.
+        :param dtype: Reduced precision to run the model in (mixed precision).
         """
-        super().__init__(model, device=device, normalize=True)
+        super().__init__(
+            model,
+            device=device,
+            normalize=True,
+            compile_model=compile_model,
+            dtype=dtype,
+        )
@@ -33,6 +33,9 @@ class Index(abc.ABC):
 
     _query_encoder: Encoder | None = None
     _quantizer: Quantizer | None = None
+    # the indices of the vectors of each document/passage, set by subclasses
+    _doc_id_to_idx: dict[str, list[int]]
+    _psg_id_to_idx: dict[str, int]
 
     def __init__(
         self,
@@ -256,6 +259,29 @@ class Index(abc.ABC):
             psg_ids,
         )
 
+    def _get_idxs(self, ids: Sequence[str]) -> list[list[int]]:
+        """Get the indices of the vectors required for each ID, depending on the mode.
+
+        IDs without any vectors are logged.
+
+        :param ids: The document/passage IDs.
+        :return: For each ID, the indices of its vectors.
+        """
+        # the mode is the same for all IDs, so it is only checked once
+        if self.mode in (Mode.MAXP, Mode.AVEP):
+            idxs_per_id = [self._doc_id_to_idx.get(id, []) for id in ids]
+        elif self.mode == Mode.FIRSTP:
+            idxs_per_id = [self._doc_id_to_idx.get(id, [])[:1] for id in ids]
+        else:
+            idxs_per_id = [
+                [self._psg_id_to_idx[id]] if id in self._psg_id_to_idx else []
+                for id in ids
+            ]
+        for id, idxs in zip(ids, idxs_per_id):
+            if len(idxs) == 0:
+                LOGGER.warning("no vectors for %s", id)
+        return idxs_per_id
+
     @abc.abstractmethod
     def _get_vectors(self, ids: Iterable[str]) -> tuple[np.ndarray, list[list[int]]]:
         """Get vectors and corresponding IDs from the index.
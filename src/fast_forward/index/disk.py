@@ -1,10 +1,11 @@
 import logging
 from collections import defaultdict
-from typing import TYPE_CHECKING, cast
+from contextlib import contextmanager
+from itertools import chain
+from typing import TYPE_CHECKING, Any, cast
 
 import h5py
 import numpy as np
-from tqdm import tqdm
 
 import fast_forward
 from fast_forward.index.base import IDSequence, Index, Mode
@@ -14,18 +15,44 @@ from fast_forward.quantizer import Quantizer
 if TYPE_CHECKING:
     from collections.abc import Iterable, Iterator
     from pathlib import Path
+    from types import TracebackType
 
     from fast_forward.encoder.base import Encoder
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _group_idxs(ids: np.ndarray, offset: int = 0) -> dict[bytes, list[int]]:
+    """Group the positions of identical IDs.
+
+    Empty IDs (i.e., missing ones) are ignored.
+
+    :param ids: The IDs (fixed-width byte strings).
+    :param offset: Offset to add to all positions.
+    :return: The positions (in ascending order) of each ID.
+    """
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    # a stable sort keeps the positions of each ID in ascending order
+    order = np.argsort(inverse, kind="stable") + offset
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(unique_ids)))[:-1]
+    return {
+        id: idxs.tolist()
+        for id, idxs in zip(unique_ids.tolist(), np.split(order, bounds))
+        if len(id) > 0
+    }
+
+
 # h5py does not play nice with pyright, so we add lots of ignores in this class
 class OnDiskIndex(Index):
     """Fast-Forward index that is read on-demand from disk.
 
     Uses HDF5 via h5py under the hood. The `max_indexing_size` argument works around an
     [h5py limitation](https://docs.h5py.org/en/latest/high/dataset.html#fancy-indexing).
+
+    The index file is opened read-only on first use and kept open afterwards, such that
+    multiple processes can use the same index at once. Use `close` (or the index as a
+    context manager) to release it. Write permissions are only held while something is
+    written to the index.
     """
 
     def __init__(
@@ -38,6 +65,8 @@ class OnDiskIndex(Index):
         init_size: int = 2**14,
         resize_min_val: int = 2**10,
         hdf5_chunk_size: int | None = None,
+        hdf5_chunk_cache_size: int = 2**26,
+        hdf5_compression: str | None = None,
         max_id_length: int = 8,
         overwrite: bool = False,
         max_indexing_size: int = 2**10,
@@ -51,10 +80,19 @@ class OnDiskIndex(Index):
         :param encoder_batch_size: Batch size for the query encoder.
         :param init_size: Initial size to allocate (number of vectors).
         :param resize_min_val: Minimum number of vectors to increase index size by.
-        :param hdf5_chunk_size: Override chunk size used by HDF5.
+        :param hdf5_chunk_size:
+            Override chunk size used by HDF5 (number of vectors). By default, chunks of
+            roughly 1 MiB are used.
+        :param hdf5_chunk_cache_size: Size of the HDF5 chunk cache (bytes).
+        :param hdf5_compression:
+            Compression filter for the vectors (e.g., "lzf" or "gzip"). Chunks are
+            decompressed entirely whenever a vector is read, hence smaller chunks should
+            be used for random access.
         :param max_id_length:
             Maximum length of document and passage IDs (number of characters).
-        :param overwrite: Overwrite index file if it exists.
+        :param overwrite:
+            Overwrite index file if it exists. The existing file is removed first, such
+            that other indexes that still use it are not affected.
         :param max_indexing_size:
             Maximum number of vectors to retrieve from the HDF5 dataset at once.
         :raises ValueError: When the file exists and `overwrite=False`.
@@ -69,13 +107,17 @@ class OnDiskIndex(Index):
         self._init_size = init_size
         self._resize_min_val = resize_min_val
         self._hdf5_chunk_size = hdf5_chunk_size
+        self._hdf5_compression = hdf5_compression
         self._max_id_length = max_id_length
         self._max_indexing_size = max_indexing_size
+        self._hdf5_chunk_cache_size = hdf5_chunk_cache_size
 
         LOGGER.debug("creating file %s", self._index_file)
+        self._index_file.unlink(missing_ok=True)
         with h5py.File(self._index_file, "w") as fp:
             fp.attrs["num_vectors"] = 0
             fp.attrs["ff_version"] = fast_forward.__version__
+        self._file = None
 
         super().__init__(
             query_encoder=query_encoder,
@@ -84,64 +126,138 @@ class OnDiskIndex(Index):
             encoder_batch_size=encoder_batch_size,
         )
 
+    @property
+    def _fp(self) -> h5py.File:
+        """Return the index file, opening it (read-only) if necessary.
+
+        :return: The index file.
+        """
+        if self._file is None:
+            self._file = h5py.File(
+                self._index_file, "r", rdcc_nbytes=self._hdf5_chunk_cache_size
+            )
+        return self._file
+
+    @contextmanager
+    def _write_access(self) -> "Iterator[None]":
+        """Reopen the index file with write permissions temporarily.
+
+        The file is closed afterwards, as write permissions prevent other processes from
+        opening it.
+        """
+        self.close()
+        self._file = h5py.File(
+            self._index_file, "a", rdcc_nbytes=self._hdf5_chunk_cache_size
+        )
+        try:
+            yield
+        finally:
+            self.close()
+
     def _on_quantizer_set(self) -> None:
         assert self.quantizer is not None
 
         # serialize the quantizer and store it on disk
-        with h5py.File(self._index_file, "a") as fp:
-            if "quantizer" in fp:
-                del fp["quantizer"]
+        with self._write_access():
+            if "quantizer" in self._fp:
+                del self._fp["quantizer"]
 
             meta, attributes, data = self.quantizer.serialize()
-            fp.create_group("quantizer/meta").attrs.update(meta)
-            fp.create_group("quantizer/attributes").attrs.update(attributes)
-            data_group = fp.create_group("quantizer/data")
+            self._fp.create_group("quantizer/meta").attrs.update(meta)
+            self._fp.create_group("quantizer/attributes").attrs.update(attributes)
+            data_group = self._fp.create_group("quantizer/data")
             for k, v in data.items():
                 data_group.create_dataset(k, data=v)
 
-    def _create_ds(self, fp: h5py.File, dim: int, dtype: np.dtype) -> None:
+    def close(self) -> None:
+        """Close the underlying index file.
+
+        The file is opened again when the index is used afterwards.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __getstate__(self) -> dict[str, Any]:
+        """Return the state of the index without the file handle for pickling.
+
+        :return: The state.
+        """
+        state = self.__dict__.copy()
+        state["_file"] = None
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        """Restore the state of the index. The file is opened again on first use.
+
+        :param state: The state.
+        """
+        vars(self).update(state)
+
+    def __enter__(self) -> "OnDiskIndex":
+        """Use the index as a context manager that closes the index file on exit.
+
+        :return: The index.
+        """
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: "TracebackType | None",
+    ) -> None:
+        """Close the index file.
+
+        :param exc_type: The exception type (if any).
+        :param exc_value: The exception (if any).
+        :param traceback: The traceback (if any).
+        """
+        self.close()
+
+    def _create_ds(self, dim: int, dtype: np.dtype) -> None:
         """Create the HDF5 datasets for vectors and IDs.
 
-        :param fp: Index file (write permissions).
         :param dim: Dimension of the vectors.
         :param dtype: Type of the vectors.
         """
-        fp.create_dataset(
+        # chunks always contain entire vectors, as they are never read partially
+        chunk_size = self._hdf5_chunk_size or max(
+            1, 2**20 // (dim * np.dtype(dtype).itemsize)
+        )
+        # IDs are much smaller than vectors, so their chunks hold more rows
+        id_chunk_size = self._hdf5_chunk_size or max(1, 2**20 // self._max_id_length)
+        self._fp.create_dataset(
             "vectors",
             (self._init_size, dim),
             dtype,
             maxshape=(None, dim),
-            chunks=(
-                True if self._hdf5_chunk_size is None else (self._hdf5_chunk_size, dim)
-            ),
+            chunks=(chunk_size, dim),
+            compression=self._hdf5_compression,
+            # grouping the bytes of the values improves compression of floats
+            shuffle=self._hdf5_compression is not None,
         )
-        fp.create_dataset(
+        self._fp.create_dataset(
             "doc_ids",
             (self._init_size,),
             f"S{self._max_id_length}",
             maxshape=(None,),
-            chunks=(
-                True if self._hdf5_chunk_size is None else (self._hdf5_chunk_size,)
-            ),
+            chunks=(id_chunk_size,),
         )
-        fp.create_dataset(
+        self._fp.create_dataset(
             "psg_ids",
             (self._init_size,),
             f"S{self._max_id_length}",
             maxshape=(None,),
-            chunks=(
-                True if self._hdf5_chunk_size is None else (self._hdf5_chunk_size,)
-            ),
+            chunks=(id_chunk_size,),
         )
 
     def _get_num_vectors(self) -> int:
-        with h5py.File(self._index_file, "r") as fp:
-            return fp.attrs["num_vectors"]  # pyright: ignore[reportReturnType]
+        return self._fp.attrs["num_vectors"]  # pyright: ignore[reportReturnType]
 
     def _get_internal_dim(self) -> int | None:
-        with h5py.File(self._index_file, "r") as fp:
-            if "vectors" in fp:
-                return fp["vectors"].shape[1]  # pyright: ignore[reportAttributeAccessIssue]
+        if "vectors" in self._fp:
+            return self._fp["vectors"].shape[1]  # pyright: ignore[reportAttributeAccessIssue]
         return None
 
     def to_memory(self, batch_size: int | None = None) -> InMemoryIndex:
@@ -157,21 +273,20 @@ class OnDiskIndex(Index):
             encoder_batch_size=self._encoder_batch_size,
             init_size=len(self),
         )
-        with h5py.File(self._index_file, "r") as fp:
-            num_vectors = cast(int, fp.attrs["num_vectors"])
+        num_vectors = cast(int, self._fp.attrs["num_vectors"])
 
-            batch_size = batch_size or num_vectors
-            for i_low in range(0, num_vectors, batch_size):
-                i_up = min(i_low + batch_size, num_vectors)
+        batch_size = batch_size or num_vectors
+        for i_low in range(0, num_vectors, batch_size):
+            i_up = min(i_low + batch_size, num_vectors)
 
-                doc_ids = fp["doc_ids"].asstr()[i_low:i_up]  # pyright: ignore[reportAttributeAccessIssue]
-                psg_ids = fp["psg_ids"].asstr()[i_low:i_up]  # pyright: ignore[reportAttributeAccessIssue]
-                vectors = fp["vectors"][i_low:i_up]  # pyright: ignore[reportIndexIssue]
+            doc_ids = self._fp["doc_ids"].asstr()[i_low:i_up]  # pyright: ignore[reportAttributeAccessIssue]
+            psg_ids = self._fp["psg_ids"].asstr()[i_low:i_up]  # pyright: ignore[reportAttributeAccessIssue]
+            vectors = self._fp["vectors"][i_low:i_up]  # pyright: ignore[reportIndexIssue]
 
-                # IDs that don't exist will be returned as empty strings here
-                doc_ids[doc_ids == ""] = None  # pyright: ignore[reportIndexIssue]
-                psg_ids[psg_ids == ""] = None  # pyright: ignore[reportIndexIssue]
-                index._add(vectors, doc_ids=doc_ids, psg_ids=psg_ids)  # pyright: ignore[reportArgumentType]
+            # IDs that don't exist will be returned as empty strings here
+            doc_ids[doc_ids == ""] = None  # pyright: ignore[reportIndexIssue]
+            psg_ids[psg_ids == ""] = None  # pyright: ignore[reportIndexIssue]
+            index._add(vectors, doc_ids=doc_ids, psg_ids=psg_ids)  # pyright: ignore[reportArgumentType]
         return index
 
     def _add(
@@ -180,20 +295,20 @@ class OnDiskIndex(Index):
         doc_ids: IDSequence,
         psg_ids: IDSequence,
     ) -> None:
-        with h5py.File(self._index_file, "a") as fp:
+        with self._write_access():
             # if this is the first call to _add, no datasets exist
-            if "vectors" not in fp:
-                self._create_ds(fp, vectors.shape[-1], vectors.dtype)
+            if "vectors" not in self._fp:
+                self._create_ds(vectors.shape[-1], vectors.dtype)
 
             # check all IDs first before adding anything
-            doc_id_size = fp["doc_ids"].dtype.itemsize  # pyright: ignore[reportAttributeAccessIssue]
+            doc_id_size = self._fp["doc_ids"].dtype.itemsize  # pyright: ignore[reportAttributeAccessIssue]
             for doc_id in doc_ids:
                 if doc_id is not None and len(doc_id) > doc_id_size:
                     raise RuntimeError(
                         f"Document ID {doc_id} is longer than the maximum "
                         f"({doc_id_size} characters)."
                     )
-            psg_id_size = fp["psg_ids"].dtype.itemsize  # pyright: ignore[reportAttributeAccessIssue]
+            psg_id_size = self._fp["psg_ids"].dtype.itemsize  # pyright: ignore[reportAttributeAccessIssue]
             for psg_id in psg_ids:
                 if psg_id is not None and len(psg_id) > psg_id_size:
                     raise RuntimeError(
@@ -202,10 +317,10 @@ class OnDiskIndex(Index):
                     )
 
             num_new_vecs = vectors.shape[0]
-            capacity = fp["vectors"].shape[0]  # pyright: ignore[reportAttributeAccessIssue]
+            capacity = self._fp["vectors"].shape[0]  # pyright: ignore[reportAttributeAccessIssue]
 
             # check if we have enough space, resize if necessary
-            cur_num_vectors = cast(int, fp.attrs["num_vectors"])
+            cur_num_vectors = cast(int, self._fp.attrs["num_vectors"])
             space_left = capacity - cur_num_vectors
             if num_new_vecs > space_left:
                 new_size = max(
@@ -214,29 +329,33 @@ class OnDiskIndex(Index):
                 )
                 LOGGER.debug("resizing index from %s to %s", capacity, new_size)
                 for ds in ("vectors", "doc_ids", "psg_ids"):
-                    fp[ds].resize(new_size, axis=0)  # pyright: ignore[reportAttributeAccessIssue]
-
-            # add new document IDs to index and in-memory mappings
-            doc_id_idxs, non_null_doc_ids = [], []
-            for i, doc_id in enumerate(doc_ids):
-                if doc_id is not None:
-                    self._doc_id_to_idx[doc_id].append(cur_num_vectors + i)
-                    doc_id_idxs.append(cur_num_vectors + i)
-                    non_null_doc_ids.append(doc_id)
-            fp["doc_ids"][doc_id_idxs] = non_null_doc_ids  # pyright: ignore[reportIndexIssue]
-
-            # add new passage IDs to index and in-memory mappings
-            psg_id_idxs, non_null_psg_ids = [], []
-            for i, psg_id in enumerate(psg_ids):
+                    self._fp[ds].resize(new_size, axis=0)  # pyright: ignore[reportAttributeAccessIssue]
+
+            # missing IDs are stored as empty strings
+            doc_ids_arr = np.array(
+                [doc_id or "" for doc_id in doc_ids], f"S{doc_id_size}"
+            )
+            psg_ids_arr = np.array(
+                [psg_id or "" for psg_id in psg_ids], f"S{psg_id_size}"
+            )
+
+            # update in-memory mappings, extending the list of each document only once
+            for doc_id, idxs in _group_idxs(doc_ids_arr, cur_num_vectors).items():
+                self._doc_id_to_idx[doc_id.decode()].extend(idxs)
+            for i, psg_id in enumerate(psg_ids, cur_num_vectors):
                 if psg_id is not None:
-                    self._psg_id_to_idx[psg_id] = cur_num_vectors + i
-                    psg_id_idxs.append(cur_num_vectors + i)
-                    non_null_psg_ids.append(psg_id)
-            fp["psg_ids"][psg_id_idxs] = non_null_psg_ids  # pyright: ignore[reportIndexIssue]
+                    self._psg_id_to_idx[psg_id] = i
+
+            # write all IDs of this batch as contiguous slices (one write each)
+            new_slice = slice(cur_num_vectors, cur_num_vectors + num_new_vecs)
+            self._fp["doc_ids"][new_slice] = doc_ids_arr  # pyright: ignore[reportIndexIssue]
+            self._fp["psg_ids"][new_slice] = psg_ids_arr  # pyright: ignore[reportIndexIssue]
 
-            # add new vectors
-            fp["vectors"][cur_num_vectors : cur_num_vectors + num_new_vecs] = vectors  # pyright: ignore[reportIndexIssue]
-            fp.attrs["num_vectors"] += num_new_vecs  # pyright: ignore[reportOperatorIssue]
+            # add new vectors without creating intermediate copies
+            self._fp["vectors"].write_direct(  # pyright: ignore[reportAttributeAccessIssue]
+                np.ascontiguousarray(vectors), dest_sel=np.s_[new_slice]
+            )
+            self._fp.attrs["num_vectors"] += num_new_vecs  # pyright: ignore[reportOperatorIssue]
 
     def _get_doc_ids(self) -> set[str]:
         return set(self._doc_id_to_idx.keys())
@@ -245,56 +364,50 @@ class OnDiskIndex(Index):
         return set(self._psg_id_to_idx.keys())
 
     def _get_vectors(self, ids: "Iterable[str]") -> tuple[np.ndarray, list[list[int]]]:
-        idx_pairs = []
-        with h5py.File(self._index_file, "r") as fp:
-            for id in ids:
-                if self.mode in (Mode.MAXP, Mode.AVEP) and id in self._doc_id_to_idx:
-                    idxs = self._doc_id_to_idx[id]
-                elif self.mode == Mode.FIRSTP and id in self._doc_id_to_idx:
-                    idxs = [self._doc_id_to_idx[id][0]]
-                elif self.mode == Mode.PASSAGE and id in self._psg_id_to_idx:
-                    idxs = [self._psg_id_to_idx[id]]
-                else:
-                    LOGGER.warning("no vectors for %s", id)
-                    idxs = []
-
-                for idx in idxs:
-                    idx_pairs.append((id, idx))
-
-            # h5py requires accessing the dataset with sorted indices
-            idx_pairs.sort(key=lambda x: x[1])
-            id_to_idxs = defaultdict(list)
-            vec_idxs = []
-            for id_idx, (id, vec_idx) in enumerate(idx_pairs):
-                vec_idxs.append(vec_idx)
-                id_to_idxs[id].append(id_idx)
-
-            # reading all vectors at once slows h5py down significantly, so we read them
-            # in chunks and concatenate
-            vectors = np.concatenate(  # pyright: ignore[reportCallIssue]
-                [
-                    fp["vectors"][vec_idxs[i : i + self._max_indexing_size]]  # pyright: ignore[reportIndexIssue, reportArgumentType]
-                    for i in range(0, len(vec_idxs), self._max_indexing_size)
-                ]
+        idxs_per_id = self._get_idxs(list(ids))
+
+        # h5py requires accessing the dataset with sorted indices, and each vector only
+        # needs to be read once, even if it is requested multiple times
+        vec_idxs, inverse = np.unique(
+            np.fromiter(chain.from_iterable(idxs_per_id), dtype=np.int64),
+            return_inverse=True,
+        )
+        # if nothing has been added yet, no datasets exist
+        if "vectors" not in self._fp:
+            return np.empty((0, 0)), [[] for _ in idxs_per_id]
+
+        # reading all vectors at once slows h5py down significantly, so we read them
+        # in chunks directly into the preallocated result
+        vectors_ds = self._fp["vectors"]
+        vectors = np.empty(
+            (len(vec_idxs), vectors_ds.shape[1]),  # pyright: ignore[reportAttributeAccessIssue]
+            dtype=vectors_ds.dtype,  # pyright: ignore[reportAttributeAccessIssue]
+        )
+        for i in range(0, len(vec_idxs), self._max_indexing_size):
+            j = min(i + self._max_indexing_size, len(vec_idxs))
+            vectors_ds.read_direct(  # pyright: ignore[reportAttributeAccessIssue]
+                vectors, source_sel=np.s_[vec_idxs[i:j]], dest_sel=np.s_[i:j]
             )
-            return vectors, [id_to_idxs[id] for id in ids]
+
+        # map the requested indices of each ID to the corresponding rows in the result
+        bounds = np.cumsum([0] + [len(idxs) for idxs in idxs_per_id])
+        return vectors, [inverse[i:j].tolist() for i, j in zip(bounds[:-1], bounds[1:])]
 
     def _batch_iter(
         self, batch_size: int
     ) -> "Iterator[tuple[np.ndarray, IDSequence, IDSequence]]":
-        with h5py.File(self._index_file, "r") as fp:
-            num_vectors = cast(int, fp.attrs["num_vectors"])
-            for i in range(0, num_vectors, batch_size):
-                j = min(i + batch_size, num_vectors)
-                doc_ids = fp["doc_ids"].asstr()[i:j]  # pyright: ignore[reportAttributeAccessIssue]
-                psg_ids = fp["psg_ids"].asstr()[i:j]  # pyright: ignore[reportAttributeAccessIssue]
-                doc_ids[doc_ids == ""] = None  # pyright: ignore[reportIndexIssue]
-                psg_ids[psg_ids == ""] = None  # pyright: ignore[reportIndexIssue]
-                yield (
-                    fp["vectors"][i:j],  # pyright: ignore[reportIndexIssue, reportReturnType]
-                    doc_ids.tolist(),  # pyright: ignore[reportAttributeAccessIssue]
-                    psg_ids.tolist(),  # pyright: ignore[reportAttributeAccessIssue]
-                )
+        num_vectors = cast(int, self._fp.attrs["num_vectors"])
+        for i in range(0, num_vectors, batch_size):
+            j = min(i + batch_size, num_vectors)
+            doc_ids = self._fp["doc_ids"].asstr()[i:j]  # pyright: ignore[reportAttributeAccessIssue]
+            psg_ids = self._fp["psg_ids"].asstr()[i:j]  # pyright: ignore[reportAttributeAccessIssue]
+            doc_ids[doc_ids == ""] = None  # pyright: ignore[reportIndexIssue]
+            psg_ids[psg_ids == ""] = None  # pyright: ignore[reportIndexIssue]
+            yield (
+                self._fp["vectors"][i:j],  # pyright: ignore[reportIndexIssue, reportReturnType]
+                doc_ids.tolist(),  # pyright: ignore[reportAttributeAccessIssue]
+                psg_ids.tolist(),  # pyright: ignore[reportAttributeAccessIssue]
+            )
 
     @classmethod
     def load(
@@ -305,9 +418,12 @@ class OnDiskIndex(Index):
         encoder_batch_size: int = 32,
         resize_min_val: int = 2**10,
         max_indexing_size: int = 2**10,
+        hdf5_chunk_cache_size: int = 2**26,
     ) -> "OnDiskIndex":
         """Open an existing index on disk.
 
+        The index file is opened read-only until something is added to the index.
+
         :param index_file: The index file to open.
         :param query_encoder: The query encoder.
         :param mode: The ranking mode.
@@ -315,6 +431,7 @@ class OnDiskIndex(Index):
         :param resize_min_val: Minimum value to increase index size by.
         :param max_indexing_size:
             Maximum number of vectors to retrieve from the HDF5 dataset at once.
+        :param hdf5_chunk_cache_size: Size of the HDF5 chunk cache (bytes).
         :return: The index.
         """
         LOGGER.debug("reading file %s", index_file)
@@ -329,32 +446,31 @@ class OnDiskIndex(Index):
         index._index_file = index_file.absolute()
         index._resize_min_val = resize_min_val
         index._max_indexing_size = max_indexing_size
+        index._hdf5_chunk_cache_size = hdf5_chunk_cache_size
+        index._file = None
 
         # deserialize quantizer if any
-        with h5py.File(index_file, "r") as fp:
-            if "quantizer" in fp:
-                index._quantizer = Quantizer.deserialize(
-                    dict(fp["quantizer/meta"].attrs),  # pyright: ignore[reportArgumentType]
-                    dict(fp["quantizer/attributes"].attrs),  # pyright: ignore[reportArgumentType]
-                    {k: v[:] for k, v in fp["quantizer/data"].items()},  # pyright: ignore[reportAttributeAccessIssue]
-                )
+        if "quantizer" in index._fp:
+            index._quantizer = Quantizer.deserialize(
+                dict(index._fp["quantizer/meta"].attrs),  # pyright: ignore[reportArgumentType]
+                dict(index._fp["quantizer/attributes"].attrs),  # pyright: ignore[reportArgumentType]
+                {k: v[:] for k, v in index._fp["quantizer/data"].items()},  # pyright: ignore[reportAttributeAccessIssue]
+            )
 
-            # read ID mappings
-            index._doc_id_to_idx = defaultdict(list)
-            index._psg_id_to_idx = {}
-
-            num_vectors = cast(int, fp.attrs["num_vectors"])
-            if num_vectors == 0:
-                return index
-
-            doc_id_iter = fp["doc_ids"].asstr()[:num_vectors]  # pyright: ignore[reportAttributeAccessIssue]
-            psg_id_iter = fp["psg_ids"].asstr()[:num_vectors]  # pyright: ignore[reportAttributeAccessIssue]
-            for i, (doc_id, psg_id) in tqdm(
-                enumerate(zip(doc_id_iter, psg_id_iter)),
-                total=num_vectors,
-            ):
-                if len(doc_id) > 0:
-                    index._doc_id_to_idx[doc_id].append(i)
-                if len(psg_id) > 0:
-                    index._psg_id_to_idx[psg_id] = i
+        # read ID mappings
+        index._doc_id_to_idx = defaultdict(list)
+        index._psg_id_to_idx = {}
+
+        num_vectors = cast(int, index._fp.attrs["num_vectors"])
+        if num_vectors == 0:
+            return index
+
+        # group the IDs using numpy rather than iterating over all vectors in python
+        LOGGER.debug("reading ID mappings of %s vectors", num_vectors)
+        doc_ids = index._fp["doc_ids"][:num_vectors]  # pyright: ignore[reportIndexIssue]
+        psg_ids = index._fp["psg_ids"][:num_vectors]  # pyright: ignore[reportIndexIssue]
+        for doc_id, idxs in _group_idxs(doc_ids).items():  # pyright: ignore[reportArgumentType]
+            index._doc_id_to_idx[doc_id.decode()] = idxs
+        for psg_id, idxs in _group_idxs(psg_ids).items():  # pyright: ignore[reportArgumentType]
+            index._psg_id_to_idx[psg_id.decode()] = idxs[-1]
         return index
@@ -150,18 +150,10 @@ class InMemoryIndex(Index):
         return shard_idx, idx_in_shard
 
     def _get_vectors(self, ids: "Iterable[str]") -> tuple[np.ndarray, list[list[int]]]:
+        # the IDs are iterated over multiple times
+        ids = list(ids)
         items_by_shard = defaultdict(list)
-        for id in ids:
-            if self.mode in (Mode.MAXP, Mode.AVEP) and id in self._doc_id_to_idx:
-                idxs = self._doc_id_to_idx[id]
-            elif self.mode == Mode.FIRSTP and id in self._doc_id_to_idx:
-                idxs = [self._doc_id_to_idx[id][0]]
-            elif self.mode == Mode.PASSAGE and id in self._psg_id_to_idx:
-                idxs = [self._psg_id_to_idx[id]]
-            else:
-                LOGGER.warning("no vectors for %s", id)
-                idxs = []
-
+        for id, idxs in zip(ids, self._get_idxs(ids)):
             for idx in idxs:
                 shard_idx, idx_in_shard = self._index_shards(idx)
                 items_by_shard[shard_idx].append((idx_in_shard, id))
@@ -169,7 +161,8 @@ class InMemoryIndex(Index):
         result_vectors = []
         result_ids = defaultdict(list)
         items_so_far = 0
-        for shard_idx, items in items_by_shard.items():
+        # shards are processed in order, such that the vectors of each ID are in order
+        for shard_idx, items in sorted(items_by_shard.items()):
             idxs, ids_ = zip(*items)
             result_vectors.append(self._shards[shard_idx][list(idxs)])
             for i, id_in_shard in enumerate(ids_):
@@ -2,6 +2,9 @@
 .. include:: ../docs/util.md
 """  # noqa: D205, D400, D415
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from typing import TYPE_CHECKING
 
 import numpy as np
@@ -10,7 +13,7 @@ from tqdm import tqdm
 from fast_forward.util.indexer import Indexer, IndexingDict
 
 if TYPE_CHECKING:
-    from collections.abc import Callable
+    from collections.abc import Callable, Iterator
 
     import pandas as pd
 
@@ -45,7 +48,68 @@ def cos_dist(a: np.ndarray, b: np.ndarray) -> float:
     :return: Cosine distance.
     """
     assert len(a.shape) == len(b.shape) == 1
-    return float(1 - np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+    # dot products only, this avoids the temporary arrays created by np.linalg.norm
+    return float(1 - np.dot(a, b) / np.sqrt(np.dot(a, a) * np.dot(b, b)))
+
+
+def _coalesce(
+    P: np.ndarray,
+    delta: float,
+    distance_function: "Callable[[np.ndarray, np.ndarray], float]",
+) -> list[np.ndarray]:
+    """Coalesce the vectors of a single document.
+
+    :param P: The vectors of the document (in order).
+    :param delta: The coalescing threshold.
+    :param distance_function: The distance function.
+    :return: The coalesced vectors.
+    """
+    # the average of the current group is maintained using its sum and size
+    P_new = []
+    A_sum = np.zeros(
+        P.shape[-1],
+        dtype=P.dtype if np.issubdtype(P.dtype, np.floating) else np.float64,
+    )
+    A_n = 0
+
+    # the cosine distance does not depend on the magnitude, so it can be computed
+    # directly using the sum of the group, and the norms of all vectors can be computed
+    # in advance
+    P_norms = np.linalg.norm(P, axis=1) if distance_function is cos_dist else None
+
+    for i, v in enumerate(P):
+        if A_n > 0:
+            if P_norms is None:
+                dist = distance_function(v, A_sum / A_n)
+            else:
+                dist = 1 - np.dot(v, A_sum) / (
+                    P_norms[i] * np.sqrt(np.dot(A_sum, A_sum))
+                )
+            if dist >= delta:
+                P_new.append(A_sum / A_n)
+                A_sum[:] = 0
+                A_n = 0
+        A_sum += v
+        A_n += 1
+    P_new.append(A_sum / A_n)
+    return P_new
+
+
+def _coalesce_chunk(
+    vectors: np.ndarray,
+    id_idxs: list[list[int]],
+    delta: float,
+    distance_function: "Callable[[np.ndarray, np.ndarray], float]",
+) -> list[list[np.ndarray]]:
+    """Coalesce the vectors of multiple documents.
+
+    :param vectors: The vectors of all documents.
+    :param id_idxs: For each document, the indices of its vectors.
+    :param delta: The coalescing threshold.
+    :param distance_function: The distance function.
+    :return: The coalesced vectors of each document.
+    """
+    return [_coalesce(vectors[idxs], delta, distance_function) for idxs in id_idxs]
 
 
 def create_coalesced_index(
@@ -54,6 +118,8 @@ def create_coalesced_index(
     delta: float,
     distance_function: "Callable[[np.ndarray, np.ndarray], float]" = cos_dist,
     batch_size: int | None = None,
+    read_batch_size: int = 2**10,
+    num_workers: int = 1,
 ) -> None:
     """Create a compressed index using sequential coalescing.
 
@@ -62,39 +128,57 @@ def create_coalesced_index(
     :param delta: The coalescing threshold.
     :param distance_function: The distance function.
     :param batch_size: Use batches instead of adding all vectors at the end.
+    :param read_batch_size: How many documents to read from the source index at once.
+    :param num_workers:
+        Number of processes to coalesce documents in parallel. If this is larger than
+        one, the distance function must be picklable.
     :raises ValueError: When the target index is not empty.
     """
     if len(target_index) > 0:
         raise ValueError("Target index is not empty.")
 
-    def _coalesce(P: np.ndarray) -> list[np.ndarray]:
-        P_new = []
-        A = []
-        A_avg = np.empty(())
-        first_iteration = True
-        for v in P:
-            if first_iteration:
-                first_iteration = False
-            elif distance_function(v, A_avg) >= delta:
-                P_new.append(A_avg)
-                A = []
-            A.append(v)
-            A_avg = np.mean(A, axis=0)
-        P_new.append(A_avg)
-        return P_new
-
-    batch_size = batch_size or len(source_index.doc_ids)
+    source_doc_ids = list(source_index.doc_ids)
+
+    def _coalesce_chunks(
+        executor: ProcessPoolExecutor | None,
+    ) -> "Iterator[tuple[list[str], list[list[np.ndarray]]]]":
+        # vectors are always read in this process, the workers only coalesce them
+        pending = deque()
+        for i in range(0, len(source_doc_ids), read_batch_size):
+            # read the vectors of multiple documents at once
+            chunk = source_doc_ids[i : i + read_batch_size]
+            args = (*source_index._get_vectors(chunk), delta, distance_function)
+            if executor is None:
+                yield chunk, _coalesce_chunk(*args)
+                continue
+
+            pending.append((chunk, executor.submit(_coalesce_chunk, *args)))
+            # limit the number of chunks held in memory
+            if len(pending) >= 2 * num_workers:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        for chunk, future in pending:
+            yield chunk, future.result()
+
+    batch_size = batch_size or len(source_doc_ids)
     vectors, doc_ids = [], []
-    for doc_id in tqdm(source_index.doc_ids):
-        # check if batch is full
-        if len(vectors) == batch_size:
-            target_index.add(np.array(vectors), doc_ids=doc_ids)
-            vectors, doc_ids = [], []
-
-        v_old, _ = source_index._get_vectors([doc_id])
-        v_new = _coalesce(v_old)
-        vectors.extend(v_new)
-        doc_ids.extend([doc_id] * len(v_new))
+    with ExitStack() as stack:
+        executor = (
+            stack.enter_context(ProcessPoolExecutor(num_workers))
+            if num_workers > 1
+            else None
+        )
+        progress_bar = stack.enter_context(tqdm(total=len(source_doc_ids)))
+        for chunk, P_new_per_doc in _coalesce_chunks(executor):
+            for doc_id, v_new in zip(chunk, P_new_per_doc):
+                # check if batch is full
+                if len(vectors) >= batch_size:
+                    target_index.add(np.array(vectors), doc_ids=doc_ids)
+                    vectors, doc_ids = [], []
+
+                vectors.extend(v_new)
+                doc_ids.extend([doc_id] * len(v_new))
+            progress_bar.update(len(chunk))
     if len(vectors) > 0:
         target_index.add(np.array(vectors), doc_ids=doc_ids)
 
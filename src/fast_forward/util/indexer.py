@@ -135,6 +135,10 @@ class Indexer:
     def _encode(self, texts: "Sequence[str]") -> np.ndarray:
         """Encode a list of strings (respecting the encoder batch size).
 
+        The texts are sorted by length, such that each batch contains texts of similar
+        lengths, which reduces the amount of padding. The order of the outputs
+        corresponds to the order of the inputs.
+
         :param texts: The pieces of text to encode.
         :raises RuntimeError: When no encoder exists.
         :return: The vector representations.
@@ -142,11 +146,17 @@ class Indexer:
         if self._encoder is None:
             raise RuntimeError("An encoder is required.")
 
+        order = np.argsort([len(text) for text in texts], kind="stable")
         result = []
         for i in range(0, len(texts), self._encoder_batch_size):
-            batch = texts[i : i + self._encoder_batch_size]
+            batch_idxs: list[int] = order[i : i + self._encoder_batch_size].tolist()
+            batch = [texts[j] for j in batch_idxs]
             result.append(self._encoder(batch))
-        return np.concatenate(result)
+
+        # restore the original order
+        vectors = np.empty_like(result[0], shape=(len(texts), result[0].shape[-1]))
+        vectors[order] = np.concatenate(result)
+        return vectors
 
     def from_dicts(self, data: "Iterable[IndexingDict]") -> None:
         """Index data from dictionaries.
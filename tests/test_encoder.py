@@ -1,6 +1,12 @@
+import importlib.util
+import pickle
+import shutil
+import tempfile
 import unittest
+from pathlib import Path
 
 import numpy as np
+import torch
 
 from fast_forward.encoder import LambdaEncoder
 from fast_forward.encoder.transformer import (
@@ -9,6 +15,7 @@ from fast_forward.encoder.transformer import (
     TASBEncoder,
     BGEEncoder,
     ContrieverEncoder,
+    TransformerEncoder,
 )
 
 from ._constants import (
@@ -20,6 +27,7 @@ from ._constants import (
 )
 
 TEST_INPUTS = ["input 1", "second input", "3rd input " * 100]
+TINY_MODEL = "hf-internal-testing/tiny-random-bert"
 
 
 class TestLambdaEncoder(unittest.TestCase):
@@ -44,6 +52,27 @@ class TestTCTColBERTEncoder(unittest.TestCase):
             decimal=5,
         )
 
+    def test_query_encoder_tokenizer_cache(self):
+        encoder = TCTColBERTQueryEncoder(tokenizer_cache_size=1)
+        for _ in range(2):
+            np.testing.assert_almost_equal(
+                encoder(TEST_INPUTS),
+                TCT_COLBERT_QUERY_EXPECTED,
+                decimal=5,
+            )
+        self.assertEqual(1, encoder._tokenize_cached.cache_info().hits)
+
+    def test_pickle(self):
+        encoder = TCTColBERTQueryEncoder(tokenizer_cache_size=1)
+        encoder(TEST_INPUTS)
+        encoder_unpickled = pickle.loads(pickle.dumps(encoder))
+        np.testing.assert_almost_equal(
+            encoder_unpickled(TEST_INPUTS),
+            TCT_COLBERT_QUERY_EXPECTED,
+            decimal=5,
+        )
+        self.assertEqual(0, encoder_unpickled._tokenize_cached.cache_info().hits)
+
     def test_doc_encoder(self):
         np.testing.assert_almost_equal(
             self.doc_encoder(TEST_INPUTS),
@@ -91,5 +120,63 @@ class TestBGEEncoder(unittest.TestCase):
         )
 
 
+class TestTransformerEncoder(unittest.TestCase):
+    def test_compile_model(self):
+        for encoder_cls in (TransformerEncoder, TCTColBERTDocumentEncoder):
+            encoder = encoder_cls(TINY_MODEL)
+            compiled_encoder = encoder_cls(TINY_MODEL, compile_model=True)
+            self.assertIsNot(compiled_encoder._forward, compiled_encoder._model)
+            np.testing.assert_almost_equal(
+                compiled_encoder(TEST_INPUTS),
+                encoder(TEST_INPUTS),
+                decimal=5,
+            )
+
+    def test_dtype(self):
+        for encoder_cls in (TransformerEncoder, TCTColBERTDocumentEncoder):
+            encoder = encoder_cls(TINY_MODEL)
+            bf16_encoder = encoder_cls(TINY_MODEL, dtype=torch.bfloat16)
+            result = bf16_encoder(TEST_INPUTS)
+            self.assertEqual(np.float32, result.dtype)
+            np.testing.assert_almost_equal(result, encoder(TEST_INPUTS), decimal=2)
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec("onnxruntime") and importlib.util.find_spec("onnxscript"),
+    "requires the onnx extra",
+)
+class TestONNXEncoder(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from fast_forward.encoder.onnx import ONNXEncoder
+
+        cls.temp_dir = Path(tempfile.mkdtemp())
+        cls.encoders = [
+            TransformerEncoder(TINY_MODEL),
+            TCTColBERTDocumentEncoder(TINY_MODEL),
+        ]
+        cls.onnx_encoders = []
+        for i, encoder in enumerate(cls.encoders):
+            encoder.export_onnx(cls.temp_dir / f"encoder_{i}.onnx")
+            cls.onnx_encoders.append(
+                ONNXEncoder(encoder, cls.temp_dir / f"encoder_{i}.onnx")
+            )
+
+    def test_encoder(self):
+        for encoder, onnx_encoder in zip(self.encoders, self.onnx_encoders):
+            np.testing.assert_almost_equal(
+                onnx_encoder(TEST_INPUTS),
+                encoder(TEST_INPUTS),
+                decimal=5,
+            )
+        # the original encoders still use their own models
+        for encoder in self.encoders:
+            self.assertIs(encoder._forward, encoder._model)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+
 if __name__ == "__main__":
     unittest.main()
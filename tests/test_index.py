@@ -1,7 +1,10 @@
 import itertools
+import pickle
 import shutil
 import tempfile
 import unittest
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from pathlib import Path
 
 import numpy as np
@@ -13,7 +16,7 @@ from fast_forward.index.disk import OnDiskIndex
 from fast_forward.index.memory import InMemoryIndex
 from fast_forward.quantizer.nanopq import NanoPQ
 from fast_forward.ranking import Ranking
-from fast_forward.util import create_coalesced_index
+from fast_forward.util import _coalesce, cos_dist, create_coalesced_index
 
 DUMMY_QUERIES = {"q1": "query 1", "q2": "query 2"}
 DUMMY_DOC_IDS = ["d0", "d0", "d1", "d2", "d3"]
@@ -104,7 +107,7 @@ class TestIndex(unittest.TestCase):
         self.assertEqual(0, len(self.index))
 
         data = np.random.normal(size=(80, 16))
-        doc_ids = [f"doc_{int(i/2)}" for i in range(data.shape[0])]
+        doc_ids = [f"doc_{int(i / 2)}" for i in range(data.shape[0])]
         psg_ids = [f"psg_{i}" for i in range(data.shape[0])]
 
         # successively add parts of the data and make sure we still get the correct vectors and indices back as the index grows
@@ -345,7 +348,11 @@ class TestIndex(unittest.TestCase):
 
         # delta = 0.2: nothing should change
         create_coalesced_index(
-            self.doc_index, self.coalesced_indexes[1], 0.2, batch_size=2
+            self.doc_index,
+            self.coalesced_indexes[1],
+            0.2,
+            batch_size=2,
+            read_batch_size=3,
         )
         self.assertEqual(self.doc_index.doc_ids, self.coalesced_indexes[1].doc_ids)
         for doc_id in self.doc_index.doc_ids:
@@ -355,6 +362,20 @@ class TestIndex(unittest.TestCase):
             for v1, v2 in zip(vectors_1, vectors_2):
                 self.assertTrue(np.array_equal(v1, v2))
 
+        # coalescing in parallel should not change the result
+        create_coalesced_index(
+            self.doc_index,
+            self.coalesced_indexes[2],
+            0.3,
+            read_batch_size=1,
+            num_workers=2,
+        )
+        self.assertEqual(self.doc_index.doc_ids, self.coalesced_indexes[2].doc_ids)
+        for doc_id in self.doc_index.doc_ids:
+            vectors_1, _ = self.coalesced_indexes[0]._get_vectors([doc_id])
+            vectors_2, _ = self.coalesced_indexes[2]._get_vectors([doc_id])
+            np.testing.assert_equal(vectors_1, vectors_2)
+
         # target index is not empty anymore
         with self.assertRaises(ValueError):
             create_coalesced_index(self.doc_index, self.coalesced_indexes[0], 0.3)
@@ -403,6 +424,7 @@ class TestInMemoryIndex(TestIndex):
         cls.coalesced_indexes = [
             InMemoryIndex(mode=Mode.MAXP),
             InMemoryIndex(mode=Mode.MAXP),
+            InMemoryIndex(mode=Mode.MAXP),
         ]
         cls.iter_indexes = [
             InMemoryIndex(init_size=2, alloc_size=2),
@@ -426,6 +448,35 @@ class TestInMemoryIndex(TestIndex):
         vecs, idxs = index._get_vectors(psg_ids)
         _test_vectors(vecs, idxs, data, [[idx] for idx in range(32)])
 
+    def test_coalescing_shards(self):
+        # documents span multiple shards and are read together with other documents
+        source_index = InMemoryIndex(init_size=4, alloc_size=4)
+        data = np.random.normal(size=(48, 16))
+        source_index.add(data, doc_ids=[f"d{i // 3}" for i in range(48)])
+
+        # the vectors of each document must be returned in order
+        vecs, idxs = source_index._get_vectors(["d2", "d1"])
+        np.testing.assert_equal(vecs[idxs[0]], data[6:9])
+        np.testing.assert_equal(vecs[idxs[1]], data[3:6])
+
+        target_index = InMemoryIndex(mode=Mode.MAXP)
+        create_coalesced_index(source_index, target_index, 0.9, read_batch_size=16)
+        for doc_id in source_index.doc_ids:
+            source_vectors, _ = source_index._get_vectors([doc_id])
+            target_vectors, _ = target_index._get_vectors([doc_id])
+            np.testing.assert_almost_equal(
+                target_vectors, _coalesce(source_vectors, 0.9, cos_dist)
+            )
+
+    def test_get_vectors_iterator(self):
+        index = InMemoryIndex(mode=Mode.MAXP)
+        index.add(DUMMY_VECTORS, doc_ids=DUMMY_DOC_IDS, psg_ids=DUMMY_PSG_IDS)
+
+        # the IDs may only be iterated over once
+        vecs, idxs = index._get_vectors(iter(["d1", "dx", "d0"]))
+        self.assertEqual(3, len(idxs))
+        _test_vectors(vecs, idxs, DUMMY_VECTORS, [[2], [], [0, 1]])
+
 
 class TestOnDiskIndex(TestIndex):
     __test__ = True
@@ -466,6 +517,7 @@ class TestOnDiskIndex(TestIndex):
         cls.coalesced_indexes = [
             OnDiskIndex(cls.temp_dir / "coalesced_index_1.h5", mode=Mode.MAXP),
             OnDiskIndex(cls.temp_dir / "coalesced_index_2.h5", mode=Mode.MAXP),
+            OnDiskIndex(cls.temp_dir / "coalesced_index_3.h5", mode=Mode.MAXP),
         ]
         cls.iter_indexes = [
             OnDiskIndex(
@@ -488,6 +540,8 @@ class TestOnDiskIndex(TestIndex):
         index_copied = OnDiskIndex.load(self.temp_dir / "doc_psg_index_copy.h5")
         self.assertEqual(index_copied.doc_ids, self.doc_psg_index.doc_ids)
         self.assertEqual(index_copied.psg_ids, self.doc_psg_index.psg_ids)
+        self.assertEqual(index_copied._doc_id_to_idx, self.doc_psg_index._doc_id_to_idx)
+        self.assertEqual(index_copied._psg_id_to_idx, self.doc_psg_index._psg_id_to_idx)
         self.doc_psg_index.mode = Mode.PASSAGE
         index_copied.mode = Mode.PASSAGE
         _test_get_vectors(index_copied, self.doc_psg_index, DUMMY_PSG_IDS)
@@ -611,11 +665,119 @@ class TestOnDiskIndex(TestIndex):
             vecs[id_idxs], psg_reps.reshape((16, 1, 16)), decimal=6
         )
 
+    def test_hdf5_chunks(self):
+        index = OnDiskIndex(self.temp_dir / "chunks_index.h5")
+        index.add(np.zeros((4, 16), dtype=np.float32), psg_ids=["p0", "p1", "p2", "p3"])
+        self.assertEqual((2**14, 16), index._fp["vectors"].chunks)
+        self.assertEqual((2**17,), index._fp["doc_ids"].chunks)
+        self.assertEqual((2**17,), index._fp["psg_ids"].chunks)
+
+        index = OnDiskIndex(self.temp_dir / "chunks_index_2.h5", hdf5_chunk_size=2)
+        index.add(np.zeros((4, 16), dtype=np.float32), psg_ids=["p0", "p1", "p2", "p3"])
+        self.assertEqual((2, 16), index._fp["vectors"].chunks)
+        self.assertEqual((2,), index._fp["doc_ids"].chunks)
+
+    def test_hdf5_compression(self):
+        index = OnDiskIndex(
+            self.temp_dir / "compressed_index.h5",
+            hdf5_chunk_size=2,
+            hdf5_compression="lzf",
+        )
+        index.add(DUMMY_VECTORS, doc_ids=DUMMY_DOC_IDS, psg_ids=DUMMY_PSG_IDS)
+        self.assertEqual("lzf", index._fp["vectors"].compression)
+        index.mode = Mode.PASSAGE
+        self.psg_index.mode = Mode.PASSAGE
+        _test_get_vectors(index, self.psg_index, DUMMY_PSG_IDS)
+
+    def test_get_vectors_duplicates(self):
+        index = OnDiskIndex(self.temp_dir / "duplicates_index.h5", mode=Mode.MAXP)
+        index.add(DUMMY_VECTORS, doc_ids=DUMMY_DOC_IDS, psg_ids=DUMMY_PSG_IDS)
+
+        # every vector should be read only once
+        vecs, idxs = index._get_vectors(["d1", "d0", "d1", "d0"])
+        self.assertEqual(3, len(vecs))
+        _test_vectors(vecs, idxs, DUMMY_VECTORS, [[2], [0, 1], [2], [0, 1]])
+
+        # IDs without vectors
+        vecs, idxs = index._get_vectors(["dx", "dy"])
+        self.assertEqual((0, DUMMY_DIM), vecs.shape)
+        self.assertEqual(DUMMY_VECTORS.dtype, vecs.dtype)
+        self.assertEqual([[], []], idxs)
+
+    def test_close(self):
+        with OnDiskIndex(self.temp_dir / "closed_index.h5") as index:
+            index.add(DUMMY_VECTORS, doc_ids=DUMMY_DOC_IDS)
+        self.assertIsNone(index._file)
+
+        # the file is opened again when the index is used
+        self.assertEqual(DUMMY_NUM, len(index))
+        index.close()
+
+        with OnDiskIndex.load(self.temp_dir / "closed_index.h5") as index_loaded:
+            self.assertEqual(DUMMY_NUM, len(index_loaded))
+            self.assertEqual(set(DUMMY_DOC_IDS), index_loaded.doc_ids)
+
+    def test_file_handles(self):
+        index = OnDiskIndex(self.temp_dir / "handles_index.h5")
+        index.add(DUMMY_VECTORS, doc_ids=DUMMY_DOC_IDS, psg_ids=DUMMY_PSG_IDS)
+
+        # write permissions are only held while adding, reading opens the file again
+        self.assertIsNone(index._file)
+        self.assertEqual(DUMMY_NUM, len(index))
+        self.assertEqual("r", index._fp.mode)
+
+        # other processes can load the index while it is in use
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            index_other = executor.submit(
+                OnDiskIndex.load, self.temp_dir / "handles_index.h5"
+            ).result()
+        _test_get_vectors(index_other, index, UNIQUE_DUMMY_DOC_IDS)
+        index_other.close()
+
+        index_unpickled = pickle.loads(pickle.dumps(index))
+        _test_get_vectors(index_unpickled, index, UNIQUE_DUMMY_DOC_IDS)
+        index_unpickled.close()
+
+        index.add(DUMMY_VECTORS[:1], doc_ids=["dx"])
+        self.assertIsNone(index._file)
+        self.assertEqual(DUMMY_NUM + 1, len(index))
+
+        # overwriting does not affect the existing index
+        index_new = OnDiskIndex(self.temp_dir / "handles_index.h5", overwrite=True)
+        self.assertEqual(0, len(index_new))
+        self.assertEqual(DUMMY_NUM + 1, len(index))
+        index_new.close()
+        index.close()
+
+    def test_concurrent_processes(self):
+        # this process writes the index, while another one reads it
+        index_file = self.temp_dir / "concurrent_index.h5"
+        index = OnDiskIndex(index_file)
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            for i in range(0, DUMMY_NUM, 2):
+                index.add(
+                    DUMMY_VECTORS[i : i + 2],
+                    doc_ids=DUMMY_DOC_IDS[i : i + 2],
+                    psg_ids=DUMMY_PSG_IDS[i : i + 2],
+                )
+                vecs, idxs = index._get_vectors(UNIQUE_DUMMY_DOC_IDS)
+                num_vectors, vecs_other, idxs_other = executor.submit(
+                    _load_and_get_vectors, index_file, UNIQUE_DUMMY_DOC_IDS
+                ).result()
+                self.assertEqual(len(index), num_vectors)
+                _test_vectors(vecs_other, idxs_other, vecs, idxs)
+        index.close()
+
     @classmethod
     def tearDownClass(cls):
         shutil.rmtree(cls.temp_dir)
 
 
+def _load_and_get_vectors(index_file, ids):
+    with OnDiskIndex.load(index_file) as index:
+        return len(index), *index._get_vectors(ids)
+
+
 def _test_get_vectors(index_1, index_2, ids):
     vecs_1, idxs_1 = index_1._get_vectors(ids)
     vecs_2, idxs_2 = index_2._get_vectors(ids)
@@ -39,6 +39,17 @@ class TestIndexer(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             Indexer(self.target_index, encoder=None).from_dicts(dicts)
 
+    def test_encode_order(self):
+        indexer = Indexer(
+            InMemoryIndex(),
+            LambdaEncoder(lambda q: np.array([len(q)])),
+            encoder_batch_size=2,
+        )
+        texts = ["aaa", "a", "aaaaa", "aa", "aaaa", "a"]
+        np.testing.assert_equal(
+            indexer._encode(texts), np.array([[len(t)] for t in texts])
+        )
+
     def test_from_index(self):
         source_index = InMemoryIndex()
         source_index.add(
@@ -1,7 +1,9 @@
 import unittest
 
+import numpy as np
+
 from fast_forward.ranking import Ranking
-from fast_forward.util import to_ir_measures
+from fast_forward.util import _coalesce, cos_dist, to_ir_measures
 
 from .test_ranking import DUMMY_QUERIES, RUN
 
@@ -15,6 +17,24 @@ class TestUtil(unittest.TestCase):
         self.assertTrue(df["score"].equals(r._df["score"]))
         self.assertEqual(set(df.columns), set(("query_id", "doc_id", "score")))
 
+    def test_cos_dist(self):
+        a, b = np.random.normal(size=(2, 16))
+        self.assertAlmostEqual(
+            1 - np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)), cos_dist(a, b)
+        )
+        self.assertAlmostEqual(0.0, cos_dist(a, 2 * a))
+        self.assertAlmostEqual(2.0, cos_dist(a, -a))
+        self.assertAlmostEqual(1.0, cos_dist(np.array([1, 0]), np.array([0, 1])))
+
+    def test_coalesce(self):
+        P = np.random.normal(size=(64, 16))
+        P[1::2] = P[::2] + 0.1 * P[1::2]
+        for delta in (0.1, 0.3, 0.5):
+            # cos_dist is computed without the generic distance function call
+            P_new = _coalesce(P, delta, cos_dist)
+            P_new_expected = _coalesce(P, delta, lambda a, b: cos_dist(a, b))
+            np.testing.assert_almost_equal(P_new, P_new_expected)
+
 
 if __name__ == "__main__":
     unittest.main()